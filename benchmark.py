@@ -0,0 +1,203 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+from json import dumps, loads
+from os import devnull
+from pathlib import Path
+from subprocess import DEVNULL, run
+from sys import executable, exit
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import modules.optimize as optimizeMod
+from modules.ffUtils.ffprobe import filterMeta
+from modules.fs import getFileListRec, nPathSort
+from modules.io import printNLog
+from modules.optimize import Config, Result, optimize
+from modules.pkgState import setLogFile
+
+# Python side benchmarks, no ffmpeg/ffprobe needed: probing and encoding are
+# replaced with fake probe json and a stub runner. Baselines are machine
+# specific, benchmark.json is kept out of git.
+
+
+def parseArgs():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--files", default=100000, type=int)
+    parser.add_argument("-e", "--e2eFiles", default=200, type=int)
+    parser.add_argument("-r", "--repeat", default=3, type=int)
+    parser.add_argument("-b", "--baseline", default="benchmark.json", type=Path)
+    parser.add_argument("-s", "--save", action="store_true")
+    parser.add_argument("-t", "--threshold", default=1.2, type=float)
+    parser.add_argument("-x", "--binary", default=None, type=Path)
+    return parser.parse_args()
+
+
+def fakeStream(idx, typ):
+    strm = {
+        "index": idx,
+        "codec_type": typ,
+        "codec_name": {"video": "h264", "audio": "aac"}.get(typ, "mov_text"),
+        "profile": "High" if typ == "video" else "LC",
+        "duration": "1200.000000",
+        "bit_rate": "2500000" if typ == "video" else "128000",
+    }
+    if typ == "video":
+        strm.update(width=1920, height=1080, r_frame_rate="24000/1001")
+    elif typ == "audio":
+        strm.update(channels=2, sample_rate="48000")
+    return strm
+
+
+def fakeMeta(file=None, nVideo=1, nAudio=4, nSubs=6):
+    types = ["video"] * nVideo + ["audio"] * nAudio + ["subtitle"] * nSubs
+    streams = [fakeStream(i, t) for i, t in enumerate(types)]
+    return {
+        "format": {"nb_streams": str(len(streams)), "duration": "1200.000000"},
+        "streams": streams,
+    }
+
+
+def stubRun(cmd, stdErr=False):
+    Path(cmd[-1]).write_bytes(b"\0" * 512)  # stands in for the encoded output
+    return ""
+
+
+def timeIt(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        strt = perf_counter()
+        fn()
+        took = perf_counter() - strt
+        best = took if best is None else min(best, took)
+    return best
+
+
+def makeTree(root, n, perDir=500):
+    for i in range(n):
+        sub = root.joinpath(f"d{i // perDir}")
+        if not i % perDir:
+            sub.mkdir()
+        sub.joinpath(f"file {i}.mp4").touch()
+
+
+def benchListing(tmp, pargs):
+    root = tmp.joinpath("tree")
+    root.mkdir()
+    makeTree(root, pargs.files)
+    files = getFileListRec(root, [".mp4"])
+    return {
+        "getFileListRec": timeIt(lambda: getFileListRec(root, [".mp4"]), pargs.repeat),
+        "nPathSort": timeIt(lambda: nPathSort(files), pargs.repeat),
+    }
+
+
+def benchFilterMeta(pargs, n=20000):
+    metaData = fakeMeta()
+    basics = ["codec_type", "codec_name", "profile", "duration", "bit_rate"]
+
+    def loop():
+        for _ in range(n):
+            filterMeta(metaData, "video", basics, ["height", "r_frame_rate"])
+            filterMeta(metaData, "audio", basics, ["channels", "sample_rate"])
+
+    return {"filterMeta": timeIt(loop, pargs.repeat) / n}
+
+
+def benchPrintNLog(tmp, pargs, n=20000):
+    setLogFile(tmp.joinpath("bench.log"))
+    msg = "Processed: 0:20:00/512.0 MB in: 0:10:00/128.0 MB at speed: x2.0."
+
+    def loop():
+        with open(devnull, "w") as f, redirect_stdout(f):
+            for _ in range(n):
+                printNLog(msg)
+
+    return {"printNLog": timeIt(loop, pargs.repeat) / n}
+
+
+def benchOrchestration(tmp, pargs):
+    optimizeMod.runCmd = stubRun
+    optimizeMod.getMetaData = lambda ffprobePath, file: fakeMeta(file)
+    historyFile = str(tmp.joinpath("history.json"))
+    config = Config(ffprobePath="ffprobe", ffmpegPath="ffmpeg", historyFile=historyFile)
+
+    def loop():
+        root = tmp.joinpath(f"e2e-{perf_counter()}")
+        root.mkdir()
+        for i in range(pargs.e2eFiles):
+            root.joinpath(f"in {i}.mp4").write_bytes(i.to_bytes(4, "big") * 256)
+        events = list(optimize(root, config))
+        assert sum(isinstance(e, Result) for e in events) == pargs.e2eFiles
+
+    return {"orchestrationPerFile": timeIt(loop, pargs.repeat) / pargs.e2eFiles}
+
+
+def benchColdStart(tmp, pargs):
+    runCli = lambda cmd: lambda: run(cmd, cwd=cwd, stdout=DEVNULL, stderr=DEVNULL)
+    cwd = Path(__file__).parent
+    cli = [executable, str(cwd.joinpath("optimizeAV.py"))]
+    emptyDir = tmp.joinpath("empty")
+    emptyDir.mkdir()
+    res = {
+        "pythonStartup": timeIt(runCli([executable, "-c", "pass"]), pargs.repeat),
+        "cliHelp": timeIt(runCli([*cli, "--help"]), pargs.repeat),
+        # --help exits before main()'s deferred imports, these go through them
+        "importOptimize": timeIt(
+            runCli([executable, "-c", "import modules.optimize"]), pargs.repeat
+        ),
+        "cliEmptyDir": timeIt(runCli([*cli, "-d", str(emptyDir)]), pargs.repeat),
+    }
+    if pargs.binary:
+        res["binaryHelp"] = timeIt(runCli([str(pargs.binary), "--help"]), pargs.repeat)
+    return res
+
+
+def compare(results, baseline, threshold):
+    slower = []
+    for name, secs in results.items():
+        base = baseline.get(name)
+        flag = ""
+        if base and secs > base * threshold:
+            flag = "  <-- SLOWER"
+            slower.append(name)
+        ratio = f"x{round(secs / base, 2)}" if base else "new"
+        print(f"{name:<22}{secs:>14.6f} s  {ratio}{flag}")
+    return slower
+
+
+def main():
+    pargs = parseArgs()
+
+    with TemporaryDirectory() as td:
+        tmp = Path(td)
+        results = {}
+        with redirect_stdout(StringIO()):
+            results.update(benchListing(tmp, pargs))
+            results.update(benchFilterMeta(pargs))
+            results.update(benchPrintNLog(tmp, pargs))
+            results.update(benchOrchestration(tmp, pargs))
+        results.update(benchColdStart(tmp, pargs))
+
+    params = {"files": pargs.files, "e2eFiles": pargs.e2eFiles}
+
+    baseline = loads(pargs.baseline.read_text()) if pargs.baseline.exists() else {}
+
+    if baseline and baseline["params"] != params:
+        print(
+            f"Baseline params {baseline['params']} differ, results may not compare.\n"
+        )
+
+    slower = compare(results, baseline.get("results", {}), pargs.threshold)
+
+    if pargs.save:
+        baseline = {"params": params, "results": results}
+        pargs.baseline.write_text(dumps(baseline, indent=2))
+        print(f"\nBaseline saved to: {str(pargs.baseline)}")
+    elif slower:
+        print(f"\n{len(slower)} benchmark(s) slower than baseline x{pargs.threshold}.")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from json import dumps, loads
+from pathlib import Path
+
+from .fs import appendFile, readFile, rmFiles
+
+# encode speed depends on the machine, not the library, so it is kept once per user
+defHistoryFile = Path.home().joinpath(".optimizeAV", "history.json")
+
+
+getJournal = lambda cacheFile: cacheFile.with_suffix(".journal")
+
+
+def setIn(cache, keys, value):
+    # None removes the key
+    *parents, last = keys
+    for key in parents:
+        cache = cache.setdefault(key, {})
+    if value is None:
+        cache.pop(last, None)
+    else:
+        cache[last] = value
+
+
+def replayJournal(cache, journal):
+    for line in readFile(journal).splitlines():
+        try:
+            keys, value = loads(line)
+        except ValueError:  # cut short by a crash
+            continue
+        setIn(cache, keys, value)
+
+
+def loadCache(cacheFile, sections=("files", "paths")):
+    cache = {}
+    if cacheFile.exists():
+        try:
+            cache = loads(readFile(cacheFile))
+        except ValueError:
+            pass
+    for section in sections:
+        cache.setdefault(section, {})
+    if getJournal(cacheFile).exists():
+        replayJournal(cache, getJournal(cacheFile))
+    return cache
+
+
+def saveCache(cacheFile, cache):
+    tmpFile = cacheFile.with_suffix(".tmp")
+    tmpFile.write_text(dumps(cache))
+    tmpFile.replace(cacheFile)
+    rmFiles([getJournal(cacheFile)])
+
+
+def logCache(cacheFile, cache, keys, value):
+    # per file updates are appended, the full cache is only written by saveCache
+    setIn(cache, keys, value)
+    if not cacheFile.parent.exists():
+        cacheFile.parent.mkdir(parents=True)
+    appendFile(getJournal(cacheFile), dumps([keys, value]) + "\n")
+
+
+getEntry = lambda cache, fp: cache["files"].setdefault(fp, {})
+
+
+def loadHistory(historyFile, cache):
+    # shared throughput samples, plus any that older library caches still hold
+    shared = loadCache(historyFile, [])
+    history = shared.setdefault("history", {})
+    for key, samples in cache.get("history", {}).items():
+        history.setdefault(key, samples)
+    return shared
+
+
+def pathStamp(file, full):
+    # unchanged size/mtime means the stored fingerprint can be reused
+    st = file.stat()
+    return [st.st_size, st.st_mtime_ns, full]
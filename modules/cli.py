@@ -1,4 +1,5 @@
 from argparse import ArgumentTypeError
+from datetime import datetime, timedelta
 from pathlib import Path
 
 
@@ -18,4 +19,15 @@ def checkValIn(valIn, typ, val):
         raise ArgumentTypeError("Invalid Value")
 
 
+def checkDeadline(val):
+    try:
+        tm = datetime.strptime(val, "%H:%M").time()
+    except ValueError:
+        raise ArgumentTypeError("Invalid time, expected HH:MM")
+    deadline = datetime.combine(datetime.now().date(), tm)
+    if deadline <= datetime.now():
+        deadline += timedelta(days=1)  # next occurrence
+    return deadline
+
+
 # change excetion type?
@@ -0,0 +1,61 @@
+from collections import Counter
+from re import compile
+
+from ..os import runCmd
+
+cropRe = compile(r"crop=(\d+):(\d+):(\d+):(\d+)")
+
+getCropCmd = lambda ffmpegPath, file, start, length: [
+    ffmpegPath,
+    "-hide_banner",
+    "-nostats",
+    "-ss",
+    str(start),
+    "-i",
+    str(file),
+    "-t",
+    str(length),
+    "-an",
+    "-sn",
+    "-dn",
+    "-vf",
+    "cropdetect=limit=24:round=2:reset=0",
+    "-f",
+    "null",
+    "-",
+]
+
+
+def sampleStarts(duration, windows):
+    # evenly spread, away from intros and credits
+    span = duration * 0.8
+    return [duration * 0.1 + span * (i + 0.5) / windows for i in range(windows)]
+
+
+def cropWindow(ffmpegPath, file, start, length):
+    cmdOut = runCmd(getCropCmd(ffmpegPath, file, round(start, 2), length), stdErr=True)
+    if isinstance(cmdOut, Exception):
+        return None
+    crops = cropRe.findall(cmdOut)
+    return tuple(map(int, crops[-1])) if crops else None  # last one has settled
+
+
+def detectCrop(ffmpegPath, file, duration, width, height, windows=6, length=2):
+    """
+    Run cropdetect over short windows of the input side by side, returns
+    [w, h, x, y] when most windows agree on a rectangle smaller than the
+    width x height source.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    starts = sampleStarts(float(duration), windows)
+    with ThreadPoolExecutor(max_workers=windows) as ex:
+        crops = list(ex.map(lambda s: cropWindow(ffmpegPath, file, s, length), starts))
+
+    votes = Counter(c for c in crops if c)
+    if not votes:
+        return None
+    crop, n = votes.most_common(1)[0]
+    if n * 2 <= windows or tuple(map(str, crop[:2])) == (str(width), str(height)):
+        return None
+    return list(crop)
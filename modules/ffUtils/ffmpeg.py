@@ -1,21 +1,61 @@
 from fractions import Fraction
 
-from ..helpers import noNoneCast, defVal
+from ..helpers import bytesToMB, defVal, noNoneCast, round2
 
-getffmpegCmd = lambda ffmpegPath, file, outFile, ca, cv, ov=[]: [
+getffmpegCmd = lambda ffmpegPath, file, outFile, ca, cv, ov=[], po=[]: [
     ffmpegPath,
     "-i",
     str(file),
     *cv,
     *ov,
     *ca,
+    *po,
     "-loglevel",
     "warning",  # or info
     str(outFile),
 ]
 
 
-def selectCodec(codec, quality=None, speed=None):
+getVerifyCmd = lambda ffmpegPath, file: [
+    ffmpegPath,
+    "-v",
+    "error",
+    "-xerror",
+    "-i",
+    str(file),
+    "-f",
+    "null",
+    "-",
+]
+
+progressOpts = ["-progress", "pipe:1", "-nostats"]
+
+faststartOpts = ["-movflags", "+faststart"]
+
+
+def growthCheck(inSize, duration, ratio, minDone=0.1):
+    # projects final size from -progress output, past the first minDone of
+    # the input so that headers and encoder warm up don't skew it
+    limit = inSize * ratio
+
+    def check(progress):
+        try:
+            outTime = progress.get("out_time_us", progress.get("out_time_ms"))
+            done = int(outTime) / 1e6 / duration  # out_time_ms is in us too
+            size = int(progress["total_size"])
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            return None
+        if done < minDone or size / done <= limit:
+            return None
+        return (
+            f"projected output size {bytesToMB(size / done)} MB exceeds {ratio} x "
+            f"input size {bytesToMB(inSize)} MB at {round2(done * 100)}% done"
+        )
+
+    return check
+
+
+def selectCodec(codec, quality=None, speed=None, loudness=None):
 
     quality = noNoneCast(str, quality)
 
@@ -106,10 +146,16 @@ def selectCodec(codec, quality=None, speed=None):
             "240",
         ]  # -g fps*10
 
+    if loudness and codec in ["aac", "he", "opus"]:
+        from .loudnorm import loudnormFilter
+
+        cdc = [*cdc, "-af", loudnormFilter(loudness)]
+        if "-ar" not in cdc:
+            cdc = [*cdc, "-ar", "48000"]  # loudnorm upsamples to 192k
     return cdc
 
 
-def optsVideo(srcRes, srcFps, limitRes, limitFps):
+def optsVideo(srcRes, srcFps, limitRes, limitFps, crop=None):
 
     opts = [
         "-pix_fmt",
@@ -121,8 +167,18 @@ def optsVideo(srcRes, srcFps, limitRes, limitFps):
     if float(Fraction(srcFps)) > limitFps:
         opts = [*opts, "-r", str(limitFps)]
 
+    vf = []
+
+    if crop:
+        w, h, x, y = crop
+        vf = [f"crop={w}:{h}:{x}:{y}"]
+        srcRes = h
+
     if int(srcRes) > limitRes:
-        opts = [*opts, "-vf", f"scale=-2:{str(limitRes)}"]
+        vf = [*vf, f"scale=-2:{str(limitRes)}"]
+
+    if vf:
+        opts = [*opts, "-vf", ",".join(vf)]
 
     return opts
 
@@ -27,6 +27,18 @@ def getMetaData(ffprobePath, file):
     return metaData
 
 
+def slimMeta(metaData, keys):
+    # only what filterMeta and getDuration read, keeps the cache small
+    fmt = metaData.get("format", {})
+    return {
+        "format": {k: fmt[k] for k in ("nb_streams", "duration") if k in fmt},
+        "streams": [
+            {k: strm[k] for k in keys if k in strm}
+            for strm in metaData.get("streams", [])
+        ],
+    }
+
+
 def getParams(metaData, strm, params):
     paramDict = {}
     for param in params:
@@ -75,6 +87,13 @@ def getMeta(metaData, meta, cdcType):
     return filterMeta(metaData, cdcType, meta["basic"], meta[cdcType])
 
 
+def getDuration(metaData):
+    try:
+        return float(metaData["format"]["duration"])
+    except (KeyError, ValueError):
+        return 0.0
+
+
 def getTags(metaData, tags):
     js = metaData["format"]["tags"]
     return [js.get(tag, "") for tag in tags]
@@ -85,14 +104,20 @@ formatParams = lambda params: "".join(
 )
 
 
-def compareDur(sourceDur, outDur, strmType, n=1):
+def durDiffMsg(sourceDur, outDur, strmType, n=1):
     # < n seconds difference will trigger warning
     diff = abs(float(sourceDur) - float(outDur))
     # if diff:
     #     msg = f"\n\nINFO: Mismatched {strmType} source and output duration."
     if diff > n:
-        msg = (
+        return (
             f"\n********\nWARNING: Differnce between {strmType} source and output "
             f"durations({str(round2(diff))} seconds) is more than {str(n)} second(s).\n"
         )
+    return ""
+
+
+def compareDur(sourceDur, outDur, strmType, n=1):
+    msg = durDiffMsg(sourceDur, outDur, strmType, n)
+    if msg:
         printNLog(msg)
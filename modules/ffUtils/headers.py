@@ -0,0 +1,436 @@
+from collections import Counter
+from fractions import Fraction
+from struct import error as StructError, iter_unpack, unpack
+
+from .ffprobe import getMetaData
+
+# Reads just enough of MP4/MOV, Matroska, WAV and FLAC headers to build an
+# ffprobe shaped dict ({"format": {...}, "streams": [...]}) for filterMeta.
+# Anything unknown or unparsable returns None so callers fall back to ffprobe.
+
+mp4Codecs = {
+    "avc1": "h264",
+    "avc3": "h264",
+    "hvc1": "hevc",
+    "hev1": "hevc",
+    "av01": "av1",
+    "vp09": "vp9",
+    "mp4v": "mpeg4",
+    "Opus": "opus",
+    "fLaC": "flac",
+    "ac-3": "ac3",
+    "ec-3": "eac3",
+    ".mp3": "mp3",
+}
+
+# mp4a is shared, the esds objectTypeIndication tells them apart
+mp4aCodecs = {0x40: "aac", 0x66: "aac", 0x67: "aac", 0x68: "aac", 0x69: "mp3"}
+mp4aCodecs[0x6B] = "mp3"
+
+maxSttsEntries = 512  # enough to find the usual frame duration
+
+mp4Handlers = {"vide": "video", "soun": "audio", "sbtl": "subtitle", "text": "subtitle"}
+
+mkvCodecs = {
+    "V_MPEG4/ISO/AVC": "h264",
+    "V_MPEGH/ISO/HEVC": "hevc",
+    "V_AV1": "av1",
+    "V_VP9": "vp9",
+    "V_VP8": "vp8",
+    "A_AAC": "aac",
+    "A_OPUS": "opus",
+    "A_VORBIS": "vorbis",
+    "A_FLAC": "flac",
+    "A_AC3": "ac3",
+    "A_EAC3": "eac3",
+    "A_DTS": "dts",
+    "A_MPEG/L3": "mp3",
+}
+
+mkvTypes = {1: "video", 2: "audio", 17: "subtitle"}
+
+wavCodecs = {(1, 8): "pcm_u8", (1, 16): "pcm_s16le", (1, 24): "pcm_s24le"}
+wavCodecs.update({(1, 32): "pcm_s32le", (3, 32): "pcm_f32le", (3, 64): "pcm_f64le"})
+
+strDur = lambda secs: f"{secs:.6f}"
+
+strRate = lambda rate: f"{rate.numerator}/{rate.denominator}"
+
+makeMeta = lambda streams, duration, fmt: {
+    "format": {
+        "format_name": fmt,
+        "nb_streams": str(len(streams)),
+        "duration": strDur(duration),
+    },
+    "streams": streams,
+}
+
+
+def readAt(f, offset, size):
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) < size:
+        raise EOFError
+    return data
+
+
+# MP4/MOV
+
+
+def iterBoxes(f, start, end):
+    pos = start
+    while pos + 8 <= end:
+        size, typ = unpack(">I4s", readAt(f, pos, 8))
+        hdr = 8
+        if size == 1:
+            size, hdr = unpack(">Q", readAt(f, pos + 8, 8))[0], 16
+        elif size == 0:
+            size = end - pos
+        if size < hdr:
+            raise ValueError("Invalid box size")
+        yield typ.decode("latin-1"), pos + hdr, min(pos + size, end)
+        pos += size
+
+
+findBox = lambda f, start, end, name: next(
+    ((s, e) for typ, s, e in iterBoxes(f, start, end) if typ == name), None
+)
+
+
+def findPath(f, start, end, path):
+    for name in path:
+        box = findBox(f, start, end, name)
+        if box is None:
+            return None
+        start, end = box
+    return start, end
+
+
+def readFullBox(f, box, limit=None):
+    start, end = box
+    size = end - start if limit is None else min(end - start, limit)
+    data = readAt(f, start, size)
+    return data[0], data[4:]  # version, payload after version/flags
+
+
+def mdhdTimes(f, box):
+    version, data = readFullBox(f, box)
+    if version == 1:
+        return unpack(">QQIQ", data[:28])[2:]
+    return unpack(">IIII", data[:16])[2:]
+
+
+def sttsRate(f, box, timescale):
+    _, data = readFullBox(f, box, 8 + maxSttsEntries * 8)
+    (count,) = unpack(">I", data[:4])
+    count = min(count, (len(data) - 4) // 8)
+    entries = list(iter_unpack(">II", data[4 : 4 + count * 8]))
+    if not entries:
+        return None
+    deltas = Counter()
+    for n, delta in entries:
+        deltas[delta] += n
+    delta = deltas.most_common(1)[0][0]
+    return Fraction(timescale, delta) if delta else None
+
+
+def stszBytes(f, box):
+    # constant sample sizes only, a per sample table isn't worth reading
+    _, data = readFullBox(f, box, 12)
+    sampleSize, count = unpack(">II", data[:8])
+    return sampleSize * count if sampleSize else None
+
+
+def readDescr(data, pos):
+    tag, pos, size = data[pos], pos + 1, 0
+    for _ in range(4):
+        size, pos = (size << 7) | (data[pos] & 0x7F), pos + 1
+        if not data[pos - 1] & 0x80:
+            break
+    return tag, pos, size
+
+
+def esdsObjectType(entry):
+    # children start after the (QuickTime version dependent) audio sample entry
+    pos = {0: 36, 1: 52, 2: 72}.get(unpack(">H", entry[16:18])[0])
+    while pos is not None and pos + 8 <= len(entry):
+        size, typ = unpack(">I4s", entry[pos : pos + 8])
+        if typ == b"esds":
+            data = entry[pos + 12 : pos + size]
+            tag, i, _ = readDescr(data, 0)
+            if tag != 0x03:  # ES_Descriptor
+                return None
+            flags, i = data[i + 2], i + 3
+            i += (2 if flags & 0x80 else 0) + (2 if flags & 0x20 else 0)
+            i += 1 + data[i] if flags & 0x40 else 0
+            tag, i, _ = readDescr(data, i)
+            return data[i] if tag == 0x04 else None  # DecoderConfigDescriptor
+        if size < 8:
+            return None
+        pos += size
+    return None
+
+
+def parseTrak(f, trak):
+    mdia = findBox(f, *trak, "mdia")
+    hdlr, mdhd = findBox(f, *mdia, "hdlr"), findBox(f, *mdia, "mdhd")
+    codecType = mp4Handlers.get(readFullBox(f, hdlr)[1][4:8].decode("latin-1"))
+    strm = {"codec_type": codecType if codecType else "data"}
+    if codecType not in ["video", "audio"]:
+        return strm
+
+    timescale, duration = mdhdTimes(f, mdhd)
+    stbl = findPath(f, *mdia, ["minf", "stbl"])
+    _, stsd = readFullBox(f, findBox(f, *stbl, "stsd"))
+    entry = stsd[4:]  # skip entry count, first sample entry only
+    fourcc = entry[4:8].decode("latin-1")
+    if fourcc == "mp4a":
+        codecName = mp4aCodecs.get(esdsObjectType(entry))
+    else:
+        codecName = mp4Codecs.get(fourcc)
+    if codecName is None:
+        return None
+
+    secs = duration / timescale
+    strm.update(codec_name=codecName, duration=strDur(secs))
+    size = stszBytes(f, findBox(f, *stbl, "stsz"))
+    if size is not None:
+        strm["bit_rate"] = str(int(size * 8 / secs))
+
+    if codecType == "video":
+        strm["width"], strm["height"] = unpack(">HH", entry[32:36])
+        rate = sttsRate(f, findBox(f, *stbl, "stts"), timescale)
+        if rate is None:
+            return None
+        strm["r_frame_rate"] = strRate(rate)
+    else:
+        strm["channels"] = unpack(">H", entry[24:26])[0]
+        strm["sample_rate"] = str(unpack(">I", entry[32:36])[0] >> 16)
+    return strm
+
+
+def parseMp4(f, size):
+    moov = findBox(f, 0, size, "moov")
+    if moov is None:
+        return None
+    version, mvhd = readFullBox(f, findBox(f, *moov, "mvhd"))
+    if version == 1:
+        timescale, duration = unpack(">IQ", mvhd[16:28])
+    else:
+        timescale, duration = unpack(">II", mvhd[8:16])
+    streams = [
+        parseTrak(f, (s, e)) for typ, s, e in iterBoxes(f, *moov) if typ == "trak"
+    ]
+    if None in streams:
+        return None
+    return makeMeta(streams, duration / timescale, "mov,mp4,m4a,3gp,3g2,mj2")
+
+
+# Matroska/WebM
+
+
+def readVint(f, keepMarker=False):
+    first = f.read(1)
+    if not first:
+        raise EOFError
+    b = first[0]
+    length = next((i + 1 for i in range(8) if b & (0x80 >> i)), None)
+    if length is None:
+        raise ValueError("Invalid EBML vint")
+    value = b if keepMarker else b & (0xFF >> length)
+    unknown = value == (0xFF >> length)
+    for byte in f.read(length - 1):
+        value = (value << 8) | byte
+        unknown = unknown and byte == 0xFF
+    return value, (None if unknown and not keepMarker else value)
+
+
+def iterElements(f, start, end):
+    pos = start
+    while end is None or pos < end:
+        f.seek(pos)
+        try:
+            eid, _ = readVint(f, keepMarker=True)
+        except EOFError:
+            return
+        _, size = readVint(f)
+        dataStart = f.tell()
+        yield eid, dataStart, size
+        if size is None:  # unknown size, only sane for the segment
+            return
+        pos = dataStart + size
+
+
+readUInt = lambda f, s, size: int.from_bytes(readAt(f, s, size), "big")
+
+readFloat = lambda f, s, size: unpack(
+    ">f" if size == 4 else ">d", readAt(f, s, size)
+)[0]
+
+
+def parseMkvTrack(f, start, size):
+    trk, video, audio = {}, {}, {}
+    for eid, s, n in iterElements(f, start, start + size):
+        if eid == 0x83:
+            trk["type"] = readUInt(f, s, n)
+        elif eid == 0x86:
+            trk["codec"] = readAt(f, s, n).decode("ascii", "ignore").rstrip("\x00")
+        elif eid == 0x23E383:
+            trk["defaultDuration"] = readUInt(f, s, n)
+        elif eid == 0xE0:
+            for vid, vs, vn in iterElements(f, s, s + n):
+                if vid in [0xB0, 0xBA]:
+                    video[vid] = readUInt(f, vs, vn)
+        elif eid == 0xE1:
+            audio.update({"channels": 1, "sampleRate": 8000.0})
+            for aid, as_, an in iterElements(f, s, s + n):
+                if aid == 0x9F:
+                    audio["channels"] = readUInt(f, as_, an)
+                elif aid == 0xB5:
+                    audio["sampleRate"] = readFloat(f, as_, an)
+
+    codecType = mkvTypes.get(trk.get("type"), "data")
+    strm = {"codec_type": codecType}
+    if codecType not in ["video", "audio"]:
+        return strm
+    codec = trk.get("codec", "")
+    codecName = mkvCodecs.get(codec, mkvCodecs.get(codec.split("/")[0]))
+    if codecName is None:
+        return None
+    strm["codec_name"] = codecName
+
+    if codecType == "video":
+        if 0xBA not in video or not trk.get("defaultDuration"):
+            return None
+        strm["width"], strm["height"] = video.get(0xB0), video[0xBA]
+        rate = Fraction(10**9, trk["defaultDuration"]).limit_denominator(1001)
+        strm["r_frame_rate"] = strRate(rate)
+    else:
+        strm["channels"] = audio.get("channels", 1)
+        strm["sample_rate"] = str(int(audio.get("sampleRate", 8000)))
+    return strm
+
+
+def parseMkv(f, size):
+    segment = next(
+        ((s, n) for eid, s, n in iterElements(f, 0, size) if eid == 0x18538067), None
+    )
+    if segment is None:
+        return None
+    segStart, segSize = segment
+    segEnd = size if segSize is None else min(segStart + segSize, size)
+    scale, duration, streams = 1000000, None, None
+
+    for eid, s, n in iterElements(f, segStart, segEnd):
+        if eid == 0x1F43B675 or n is None:  # Cluster, media data follows
+            break
+        if eid == 0x1549A966:  # Info
+            for iid, is_, in_ in iterElements(f, s, s + n):
+                if iid == 0x2AD7B1:
+                    scale = readUInt(f, is_, in_)
+                elif iid == 0x4489:
+                    duration = readFloat(f, is_, in_)
+        elif eid == 0x1654AE6B:  # Tracks
+            streams = [
+                parseMkvTrack(f, ts, tn)
+                for tid, ts, tn in iterElements(f, s, s + n)
+                if tid == 0xAE
+            ]
+        if duration is not None and streams is not None:
+            break
+
+    if duration is None or not streams or None in streams:
+        return None
+    secs = duration * scale / 1e9
+    for strm in streams:
+        if strm["codec_type"] in ["video", "audio"]:
+            strm["duration"] = strDur(secs)
+    return makeMeta(streams, secs, "matroska,webm")
+
+
+# WAV/FLAC
+
+
+def iterRiff(f, start, end):
+    pos = start
+    while pos + 8 <= end:
+        typ, size = unpack("<4sI", readAt(f, pos, 8))
+        yield typ.decode("latin-1"), pos + 8, min(pos + 8 + size, end)
+        pos += 8 + size + (size & 1)
+
+
+def parseWav(f, size):
+    fmt, dataSize = None, None
+    for typ, s, e in iterRiff(f, 12, size):
+        if typ == "fmt ":
+            fmt = unpack("<HHIIHH", readAt(f, s, 16))
+            if fmt[0] == 0xFFFE:  # WAVE_FORMAT_EXTENSIBLE, subformat guid
+                fmt = (unpack("<H", readAt(f, s + 24, 2))[0], *fmt[1:])
+        elif typ == "data":
+            dataSize = e - s
+    if fmt is None or dataSize is None or (fmt[0], fmt[5]) not in wavCodecs:
+        return None
+    audioFmt, channels, sampleRate, byteRate, _, bits = fmt
+    strm = {
+        "codec_type": "audio",
+        "codec_name": wavCodecs[(audioFmt, bits)],
+        "duration": strDur(dataSize / byteRate),
+        "bit_rate": str(byteRate * 8),
+        "channels": channels,
+        "sample_rate": str(sampleRate),
+    }
+    return makeMeta([strm], dataSize / byteRate, "wav")
+
+
+def parseFlac(f, size):
+    hdr = readAt(f, 4, 4)
+    if hdr[0] & 0x7F != 0:  # STREAMINFO must come first
+        return None
+    info = int.from_bytes(readAt(f, 18, 8), "big")
+    sampleRate = info >> 44
+    channels = ((info >> 41) & 0x7) + 1
+    samples = info & 0xFFFFFFFFF
+    if not sampleRate or not samples:
+        return None
+    strm = {
+        "codec_type": "audio",
+        "codec_name": "flac",
+        "duration": strDur(samples / sampleRate),
+        "channels": channels,
+        "sample_rate": str(sampleRate),
+    }
+    return makeMeta([strm], samples / sampleRate, "flac")
+
+
+def sniffParser(magic):
+    if magic[4:8] in [b"ftyp", b"moov", b"wide", b"free", b"mdat", b"skip"]:
+        return parseMp4
+    if magic[:4] == b"\x1a\x45\xdf\xa3":
+        return parseMkv
+    if magic[:4] == b"RIFF" and magic[8:12] == b"WAVE":
+        return parseWav
+    if magic[:4] == b"fLaC":
+        return parseFlac
+    return None
+
+
+# truncated or malformed headers, all mean "ask ffprobe"
+parseErrors = (OSError, EOFError, IndexError, ValueError, TypeError, StructError)
+parseErrors += (ZeroDivisionError,)
+
+
+def getMetaDataNative(file):
+    try:
+        size = file.stat().st_size
+        with open(file, "rb") as f:
+            parser = sniffParser(f.read(12))
+            return parser(f, size) if parser else None
+    except parseErrors:
+        return None
+
+
+def getMetaDataFast(ffprobePath, file):
+    metaData = getMetaDataNative(file)
+    if metaData is None:
+        return getMetaData(ffprobePath, file)
+    return metaData
@@ -0,0 +1,71 @@
+from json import loads as jLoads
+
+from ..os import runCmd
+
+# EBU R128 targets suited to speech
+target = {"I": -16.0, "TP": -1.5, "LRA": 11.0}
+
+measured = ["input_i", "input_tp", "input_lra", "input_thresh"]
+
+# ranges loudnorm accepts for its measured_* options
+limits = {
+    "input_i": (-99.0, 0.0),
+    "input_tp": (-99.0, 99.0),
+    "input_lra": (0.0, 99.0),
+    "input_thresh": (-99.0, 0.0),
+}
+
+targetOpts = lambda: ":".join([f"{k}={v}" for k, v in target.items()])
+
+getLoudnessCmd = lambda ffmpegPath, file: [
+    ffmpegPath,
+    "-hide_banner",
+    "-nostats",
+    "-i",
+    str(file),
+    "-vn",
+    "-sn",
+    "-dn",
+    "-af",
+    f"loudnorm={targetOpts()}:print_format=json",
+    "-f",
+    "null",
+    "-",
+]
+
+
+def checkLoudness(loudness):
+    # silent audio measures -inf, None means don't normalize
+    try:
+        inRange = all(lo <= float(loudness[k]) <= hi for k, (lo, hi) in limits.items())
+    except (TypeError, KeyError, ValueError):
+        return None
+    return loudness if inRange else None
+
+
+def parseLoudness(stdErr):
+    # loudnorm prints its json summary last
+    try:
+        js = jLoads(stdErr[stdErr.rindex("{") : stdErr.rindex("}") + 1])
+        return checkLoudness({k: js[k] for k in measured})
+    except (ValueError, KeyError) as parseErr:
+        return parseErr
+
+
+def measureLoudness(ffmpegPath, file):
+    cmdOut = runCmd(getLoudnessCmd(ffmpegPath, file), stdErr=True)
+    if isinstance(cmdOut, Exception):
+        return cmdOut
+    return parseLoudness(cmdOut)
+
+
+def loudnormFilter(loudness):
+    # single pass linear normalization from cached measurements
+    return (
+        f"loudnorm={targetOpts()}"
+        f":measured_I={loudness['input_i']}"
+        f":measured_TP={loudness['input_tp']}"
+        f":measured_LRA={loudness['input_lra']}"
+        f":measured_thresh={loudness['input_thresh']}"
+        ":linear=true"
+    )
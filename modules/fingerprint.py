@@ -0,0 +1,25 @@
+from hashlib import blake2b
+from mmap import ACCESS_READ, mmap
+
+blockSize = 1 << 16  # 64 KiB per sampled block
+
+
+def sampleOffsets(size, n=blockSize):
+    # head, middle and tail blocks; small files are hashed whole
+    if size <= n * 3:
+        return [(0, size)]
+    return [(0, n), ((size - n) // 2, n), (size - n, n)]
+
+
+fullOffsets = lambda size, n=blockSize * 16: [(i, n) for i in range(0, size, n)]
+
+
+def getFingerprint(file, full=False):
+    size = file.stat().st_size
+    hsh = blake2b(str(size).encode(), digest_size=16)
+    if size:
+        with open(file, "rb") as f, mmap(f.fileno(), 0, access=ACCESS_READ) as mm:
+            offsets = fullOffsets(size) if full else sampleOffsets(size)
+            for start, length in offsets:
+                hsh.update(mm[start : start + length])
+    return f"{size}-{hsh.hexdigest()}"
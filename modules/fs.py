@@ -1,5 +1,7 @@
 from functools import partial
+from os import fstat, link
 from pathlib import Path
+from shutil import copy2
 from re import sub
 from unicodedata import normalize
 
@@ -59,6 +61,48 @@ def rmFiles(paths):
             path.unlink()
 
 
+FICLONE = 0x40049409  # linux/fs.h
+
+
+def reflinkFile(src, dst):
+    from fcntl import ioctl  # posix only
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def copyRangeFile(src, dst):
+    from os import copy_file_range  # linux, python 3.8+
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        left = fstat(s.fileno()).st_size
+        while left > 0:
+            copied = copy_file_range(s.fileno(), d.fileno(), left)
+            if not copied:
+                raise OSError(f"copy_file_range stopped short: {str(src)}")
+            left -= copied
+
+
+linkMethods = {"reflink": reflinkFile, "copyRange": copyRangeFile, "hardlink": link}
+
+
+def linkFile(src, dst, methods=("reflink", "hardlink")):
+    # tries each of methods then a plain copy, returns the method that worked
+    if not dst.parent.exists():
+        dst.parent.mkdir(parents=True)
+    for method in methods:
+        try:
+            linkMethods[method](src, dst)
+            return method
+        except (ImportError, OSError):
+            rmFiles([dst])
+    copy2(src, dst)
+    return "copy"
+
+
+cloneFile = partial(linkFile, methods=("reflink", "copyRange", "hardlink"))
+
+
 getFileSizes = lambda fileList: sum([file.stat().st_size for file in fileList])
 
 nPathSort = partial(sorted, key=lambda k: nSort(str(k.stem)))
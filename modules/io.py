@@ -19,7 +19,7 @@ def printNLog(msg):
 
 def reportErr(exp=None):
     printNLog("\n------\nERROR: Something went wrong.")
-    if exp and exp.stderr:
+    if getattr(exp, "stderr", None):
         printNLog(f"\nStdErr: {exp.stderr}\nReturn Code: {exp.returncode}")
     if exp:
         printNLog(
@@ -0,0 +1,640 @@
+from dataclasses import dataclass, field, fields, replace
+from datetime import datetime
+from os import cpu_count
+from fractions import Fraction
+from functools import partial
+from pathlib import Path
+from statistics import fmean
+from sys import version_info
+from time import perf_counter
+
+from .cache import (
+    defHistoryFile,
+    getEntry,
+    getJournal,
+    loadCache,
+    loadHistory,
+    logCache,
+    pathStamp,
+    saveCache,
+)
+from .ffUtils.ffmpeg import (
+    faststartOpts,
+    getffmpegCmd,
+    getVerifyCmd,
+    growthCheck,
+    optsVideo,
+    progressOpts,
+    selectCodec,
+)
+from .ffUtils.ffprobe import (
+    durDiffMsg,
+    getDuration,
+    getMeta,
+    getMetaData,
+    slimMeta,
+)
+from .fs import (
+    cloneFile,
+    getFileList,
+    getFileListRec,
+    linkFile,
+    makeTargetDirs,
+    rmEmptyDirs,
+    rmFiles,
+)
+from .helpers import fileDTime, secsToHMS
+from .os import CmdAborted, checkPaths, runCmd, runCmdLow, runCmdWatch
+from .throughput import addSample, getKey, orderFiles, predictSecs, workUnits
+
+defaultPaths = {
+    "ffprobe": r"C:\ffmpeg\bin\ffprobe.exe",
+    "ffmpeg": r"C:\ffmpeg\bin\ffmpeg.exe",
+}
+
+meta = {
+    "basic": ["codec_type", "codec_name", "profile", "duration", "bit_rate"],
+    "audio": ["channels", "sample_rate"],
+    "video": ["width", "height", "r_frame_rate"],
+}
+
+metaKeys = [k for keys in meta.values() for k in keys]
+
+
+@dataclass
+class Config:
+    cAudio: str = "he"
+    cVideo: str = "hevc"
+    qAudio: int = None
+    qVideo: int = None
+    speed: str = None
+    res: int = 720
+    fps: int = 30
+    recursive: bool = False
+    dedup: bool = False
+    fullHash: bool = False
+    order: str = None
+    loudnorm: bool = False
+    fastProbe: bool = False
+    growAbort: float = None
+    growFallback: str = "copy"
+    autoCrop: bool = False
+    deadline: datetime = None
+    historyFile: str = None
+    verify: bool = False
+    ffprobePath: str = None
+    ffmpegPath: str = None
+
+    @property
+    def noVideo(self):
+        return self.cVideo == "vn"
+
+
+getHistoryFile = lambda config: (
+    Path(config.historyFile) if config.historyFile else defHistoryFile
+)
+
+configFromArgs = lambda pargs: Config(
+    **{f.name: getattr(pargs, f.name) for f in fields(Config) if hasattr(pargs, f.name)}
+)
+
+
+# Events yielded by optimize()
+
+
+@dataclass
+class Started:
+    root: Path
+    outDir: Path
+    total: int
+
+
+@dataclass
+class Status:
+    status: str
+    idx: int
+    total: int
+    file: Path
+
+
+@dataclass
+class Command:
+    cmd: list
+
+
+@dataclass
+class Message:
+    text: str
+
+
+@dataclass
+class Failed:
+    error: Exception
+
+
+@dataclass
+class Report:
+    reportFile: Path
+    rows: list
+
+
+@dataclass
+class Result:
+    idx: int
+    total: int
+    file: Path
+    outFile: Path
+    inSize: int
+    outSize: int
+    length: float
+    timeTaken: float
+    timeLeft: float
+    filesLeft: int
+    inParams: dict = field(default_factory=dict)
+    outParams: dict = field(default_factory=dict)
+
+
+mp4Exts = [".mp4", ".m4a"]
+
+# everything that changes what an output looks like, dedup only links on a match
+outSettings = ["cVideo", "cAudio", "qVideo", "qAudio", "speed", "res", "fps"]
+outSettings += ["loudnorm", "autoCrop"]
+
+getOutKey = lambda config: ":".join(str(getattr(config, k)) for k in outSettings)
+
+formatCrop = lambda crop: "{}x{} at {},{}".format(*crop)
+
+
+def getFormats(config):
+    if config.noVideo:
+        formats = [".flac", ".wav", ".m4a", ".mp3", ".mp4"]
+        outExt = ".opus" if config.cAudio == "opus" else ".m4a"
+    else:
+        formats = [".mp4", ".mov", ".mkv", ".avi"]
+        outExt = ".mp4"
+    return formats, outExt
+
+
+def getWork(config, height, fps, duration):
+    # height/fps of the source, capped by the output limits
+    if config.noVideo or config.cVideo == "vc":
+        return workUnits(duration)
+    try:
+        height = min(int(height), config.res)
+        fps = min(float(Fraction(fps)), config.fps)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return workUnits(duration)
+    return workUnits(duration, height, fps)
+
+
+def getMetaWork(config, metaData):
+    vdoParams = getMeta(metaData, meta, "video")
+    height, fps = vdoParams.get("height"), vdoParams.get("r_frame_rate")
+    return getWork(config, height, fps, getDuration(metaData))
+
+
+def isCopyOnly(config, metaData):
+    # nothing to encode and nothing that ffmpeg's default stream selection drops
+    if config.cAudio != "ac" or config.cVideo not in ("vc", "vn"):
+        return False
+    types = [s.get("codec_type") for s in metaData.get("streams", [])]
+    keep = ["audio"] if config.noVideo else ["video", "audio"]
+    return set(types) <= set(keep) and all(types.count(t) <= 1 for t in keep)
+
+
+def cloneInput(file, outFile):
+    try:
+        return f"\nCloned input ({cloneFile(file, outFile)}), nothing to remux."
+    except OSError as err:
+        return err
+
+
+def scanFile(config, cache, file):
+    # returns the fingerprint and whether anything new went into the cache
+    stamp, fresh = pathStamp(file, config.fullHash), False
+    known = cache["paths"].get(str(file))
+    if known and known[:-1] == stamp:
+        fp = known[-1]
+    else:
+        from .fingerprint import getFingerprint
+
+        fp = getFingerprint(file, config.fullHash)
+        cache["paths"][str(file)] = [*stamp, fp]
+        fresh = True
+    entry = getEntry(cache, fp)
+    if "meta" not in entry:
+        probe = getMetaData
+        if config.fastProbe:
+            from .ffUtils.headers import getMetaDataFast as probe
+        metaData = probe(config.ffprobePath, file)
+        if isinstance(metaData, Exception):
+            return metaData, fresh
+        entry["meta"] = slimMeta(metaData, metaKeys)
+        fresh = True
+    return fp, fresh
+
+
+def scanFiles(config, cache, fileList):
+    fpOf, fresh = {}, False
+    for file in fileList:
+        fp, isNew = scanFile(config, cache, file)
+        fresh = fresh or isNew
+        if isinstance(fp, Exception):
+            yield Failed(fp)
+            continue
+        fpOf[file] = fp
+    return fpOf, fresh
+
+
+measureJobs = min(4, cpu_count() or 1)
+
+
+def measureFiles(config, files):
+    # audio only decodes, run side by side
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .ffUtils.loudnorm import measureLoudness
+
+    with ThreadPoolExecutor(max_workers=measureJobs) as ex:
+        return zip(files, ex.map(partial(measureLoudness, config.ffmpegPath), files))
+
+
+def listFiles(config, path):
+    formats, _ = getFormats(config)
+    if path.is_file():
+        return path.parent, [path]
+    getFilePaths = getFileListRec if config.recursive else getFileList
+    return path, getFilePaths(path, formats)
+
+
+def withPaths(config):
+    # resolved on a copy, the caller's config is left untouched
+    config = config if config else Config()
+    if config.ffprobePath and config.ffmpegPath:
+        return config
+    ffprobePath, ffmpegPath = checkPaths(defaultPaths)
+    return replace(config, ffprobePath=ffprobePath, ffmpegPath=ffmpegPath)
+
+
+def iterRoots(paths, config):
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+    for path in paths:
+        root, fileList = listFiles(config, Path(path).resolve())
+        if fileList:
+            yield root, fileList
+
+
+def optimize(paths, config=None):
+    """
+    Encode every supported file under each of paths (directories or single
+    files) and yield Started/Status/Command/Message/Failed/Result events.
+    """
+    config = withPaths(config)
+    for root, fileList in iterRoots(paths, config):
+        yield from optimizeDir(config, root, fileList)
+
+
+def prepOutDir(config, dirPath, fileList):
+    _, outExt = getFormats(config)
+    outDir = makeTargetDirs(dirPath, [f"out-{outExt[1:]}"])[0]
+
+    if config.recursive:
+        if version_info >= (3, 9):
+            fileList = [f for f in fileList if not f.is_relative_to(outDir)]
+        else:
+            fileList = [f for f in fileList if not (str(outDir) in str(f))]
+
+    return outDir, fileList
+
+
+def optimizeDir(config, dirPath, fileList):
+    _, outExt = getFormats(config)
+    getFilePaths = getFileListRec if config.recursive else getFileList
+
+    outDir, fileList = prepOutDir(config, dirPath, fileList)
+    tmpFile = outDir.joinpath(f"tmp-{fileDTime()}{outExt}")
+    cacheFile = outDir.joinpath(f"{dirPath.stem}.cache.json")
+    cache = loadCache(cacheFile)
+    historyFile = getHistoryFile(config)
+    shared = loadHistory(historyFile, cache)
+    history = shared["history"]
+    codecKey = f"{config.cVideo}/{config.cAudio}"
+    outKey = getOutKey(config)
+    scheduled = False
+    if config.deadline:
+        from .schedule import getPredictor, planPresets, presetLadders
+
+        scheduled = config.cVideo in presetLadders
+    presetOf, predict = {}, None
+    verifier, pending, requeued, links = None, {}, set(), {}
+    changed = False
+
+    outFileList = set(getFilePaths(outDir, [outExt]))
+
+    getOutFile = lambda file: Path(
+        outDir.joinpath(file.relative_to(dirPath).with_suffix(outExt))
+    )
+
+    try:
+        yield Started(dirPath, outDir, len(fileList))
+
+        toScan = [f for f in fileList if getOutFile(f) not in outFileList]
+        fpOf, changed = yield from scanFiles(config, cache, toScan)
+        works = {
+            f: getMetaWork(config, cache["files"][fp]["meta"]) for f, fp in fpOf.items()
+        }
+        totalTime = []
+
+        if config.loudnorm and config.cAudio != "ac":
+            toMeasure = [f for f in fpOf if "loudness" not in cache["files"][fpOf[f]]]
+            for file, loudness in measureFiles(config, toMeasure):
+                if isinstance(loudness, Exception):
+                    yield Failed(loudness)
+                    continue
+                # False for measured but unusable, None would drop the key
+                keys = ["files", fpOf[file], "loudness"]
+                logCache(cacheFile, cache, keys, loudness or False)
+
+        fileList = [f for f in fileList if f in fpOf or getOutFile(f) in outFileList]
+
+        def estimateSecs(file):
+            if file not in works:
+                return 0.0
+            if file in presetOf:
+                ladder = presetLadders[config.cVideo]
+                return predict(ladder.index(presetOf[file]), works[file])
+            secs = predictSecs(history, getKey(codecKey, config.speed), works[file])
+            if secs is None:
+                return fmean(totalTime) if totalTime else works[file]
+            return secs
+
+        fileList = orderFiles(fileList, estimateSecs, config.order)
+
+        if config.verify:
+            from concurrent.futures import ThreadPoolExecutor
+
+            # one low priority decode at a time, overlapping the next encode
+            verifier = ThreadPoolExecutor(max_workers=1)
+            verifyOut = lambda file, outFile: pending.setdefault(
+                verifier.submit(runCmdLow, getVerifyCmd(config.ffmpegPath, outFile)),
+                (file, outFile),
+            )
+            # outputs from earlier runs that never finished verifying
+            verified = cache.setdefault("verified", {})
+            for file in fileList:
+                outFile = getOutFile(file)
+                if outFile in outFileList and not verified.get(str(outFile)):
+                    verifyOut(file, outFile)
+
+        def dropOutput(file, outFile):
+            # forget a bad output, scanning its input if it was skipped so far
+            if file not in fpOf:
+                fp, _ = scanFile(config, cache, file)
+                if isinstance(fp, Exception):
+                    return fp
+                fpOf[file] = fp
+                works[file] = getMetaWork(config, cache["files"][fp]["meta"])
+            outs = cache["files"][fpOf[file]].get("outs", {})
+            for key in [k for k, path in outs.items() if path == str(outFile)]:
+                logCache(cacheFile, cache, ["files", fpOf[file], "outs", key], None)
+
+        def checkVerified(block=False):
+            from concurrent.futures import FIRST_COMPLETED, wait
+
+            done, _ = wait(pending, 0 if not block else None, FIRST_COMPLETED)
+            for future in done:
+                file, outFile = pending.pop(future)
+                cmdOut = future.result()
+                isGood = not isinstance(cmdOut, Exception)
+                logCache(cacheFile, cache, ["verified", str(outFile)], isGood)
+                if isGood:
+                    for _, dupOut in links.get(outFile, []):
+                        logCache(cacheFile, cache, ["verified", str(dupOut)], True)
+                    yield Message(f"\nVerified: {str(outFile)}")
+                    continue
+                # duplicates linked to the bad output go with it
+                dups = links.pop(outFile, [])
+                rmFiles([outFile, *[dupOut for _, dupOut in dups]])
+                yield Failed(cmdOut)
+                for bad, badOut in [(file, outFile), *dups]:
+                    logCache(cacheFile, cache, ["verified", str(badOut)], None)
+                    dropErr = dropOutput(bad, outFile)
+                    if dropErr:
+                        yield Failed(dropErr)
+                    elif bad not in requeued:
+                        requeued.add(bad)
+                        fileList.append(bad)
+                        yield Message(f"\nVerification failed, requeued: {str(bad)}")
+
+        idx = 0
+        while idx < len(fileList) or pending:
+            if idx == len(fileList):
+                yield from checkVerified(block=True)
+                continue
+            if pending:
+                yield from checkVerified()
+
+            file = fileList[idx]
+            idx += 1
+            total = len(fileList)
+
+            outFile = getOutFile(file)
+
+            statusP = partial(Status, idx=idx, total=total, file=file)
+
+            if file not in fpOf:
+                yield statusP("Skipping")
+                continue
+
+            entry = getEntry(cache, fpOf[file])
+
+            if config.dedup and outKey in entry.get("outs", {}):
+                dupFile = Path(entry["outs"][outKey])
+                if dupFile.exists() and dupFile != outFile:
+                    method = linkFile(dupFile, outFile)
+                    links.setdefault(dupFile, []).append((file, outFile))
+                    if cache.get("verified", {}).get(str(dupFile)):
+                        logCache(cacheFile, cache, ["verified", str(outFile)], True)
+                    yield statusP("Linked")
+                    yield Message(f"\nDuplicate of: {str(dupFile)} ({method})")
+                    continue
+
+            yield statusP("Processing")
+
+            speed = config.speed
+            if scheduled:
+                # re-planned before every file with the latest measured speeds
+                budget = (config.deadline - datetime.now()).total_seconds()
+                predict = getPredictor(history, codecKey, config.cVideo)
+                presetOf, planned = planPresets(
+                    [f for f in fileList[idx - 1 :] if f in works],
+                    works,
+                    predict,
+                    presetLadders[config.cVideo],
+                    budget,
+                )
+                speed = presetOf[file]
+                yield Message(
+                    f"\nScheduled preset: {speed}, queue planned at"
+                    f" {secsToHMS(planned)} with {secsToHMS(max(budget, 0))}"
+                    " left until the deadline."
+                )
+
+            metaData = entry["meta"]
+
+            getMetaP = partial(getMeta, metaData, meta)
+
+            inParams, ov = {}, []
+
+            if not config.noVideo:
+                inParams["video"] = getMetaP("video")
+
+                if not config.cVideo == "vc":
+                    crop = None
+                    if config.autoCrop:
+                        from .ffUtils.cropdetect import detectCrop
+
+                        if "crop" not in entry:
+                            crop = detectCrop(
+                                config.ffmpegPath,
+                                file,
+                                getDuration(metaData),
+                                inParams["video"]["width"],
+                                inParams["video"]["height"],
+                            )
+                            keys = ["files", fpOf[file], "crop"]
+                            logCache(cacheFile, cache, keys, crop or False)
+                        crop = entry["crop"]
+                        if crop:
+                            yield Message(f"\nCropping to: {formatCrop(crop)}")
+                    ov = optsVideo(
+                        inParams["video"]["height"],
+                        inParams["video"]["r_frame_rate"],
+                        config.res,
+                        config.fps,
+                        crop,
+                    )
+
+            inParams["audio"] = getMetaP("audio")
+
+            copyOnly = isCopyOnly(config, metaData)
+            cloned = copyOnly and file.suffix.lower() == outExt
+            if copyOnly and outExt in mp4Exts:
+                ov = faststartOpts  # container change, remux with the index up front
+
+            loudness = None
+            if config.loudnorm and config.cAudio != "ac":
+                from .ffUtils.loudnorm import checkLoudness
+
+                loudness = checkLoudness(entry.get("loudness"))
+                if not loudness:
+                    yield Message("\nNo usable loudness measurement, not normalizing.")
+            ca = selectCodec(config.cAudio, config.qAudio, loudness=loudness)
+            cv = selectCodec(config.cVideo, config.qVideo, speed)
+            po = progressOpts if config.growAbort else []
+            cmd = getffmpegCmd(config.ffmpegPath, file, tmpFile, ca, cv, ov, po)
+
+            if not cloned:
+                yield Command(cmd)
+            strtTime = perf_counter()
+            if cloned:
+                cmdOut = cloneInput(file, tmpFile)
+            elif config.growAbort:
+                inSize, duration = file.stat().st_size, getDuration(metaData)
+                check = growthCheck(inSize, duration, config.growAbort)
+                cmdOut = runCmdWatch(cmd, check)
+            else:
+                cmdOut = runCmd(cmd)
+
+            aborted = isinstance(cmdOut, CmdAborted)
+            if aborted:
+                rmFiles([tmpFile])
+                if config.growFallback == "skip":
+                    yield Message(f"\nAborted encode, {str(cmdOut)}; skipping file.")
+                    yield statusP("Skipping")
+                    continue
+                yield Message(f"\nAborted encode, {str(cmdOut)}; copying streams.")
+                ca = selectCodec("ac")
+                cv = selectCodec("vn" if config.noVideo else "vc")
+                cmd = getffmpegCmd(config.ffmpegPath, file, tmpFile, ca, cv)
+                yield Command(cmd)
+                cmdOut = runCmd(cmd)
+                if isinstance(cmdOut, Exception):
+                    # e.g. codecs the output container can't hold
+                    rmFiles([tmpFile])
+                    reason = getattr(cmdOut, "stderr", None) or str(cmdOut)
+                    yield Message(f"\nStream copy failed: {reason.strip()}")
+                    yield statusP("Skipping")
+                    continue
+
+            if isinstance(cmdOut, Exception):
+                yield Failed(cmdOut)
+                return
+            timeTaken = perf_counter() - strtTime
+            totalTime.append(timeTaken)
+            if not (aborted or cloned):
+                speedKey = getKey(codecKey, speed)
+                addSample(history, speedKey, works[file], timeTaken)
+                logCache(historyFile, shared, ["history", speedKey], history[speedKey])
+
+            yield Message(cmdOut)
+            if not outFile.parent.exists():
+                outFile.parent.mkdir(parents=True)
+
+            tmpFile.rename(outFile)
+
+            yield statusP("Processed")
+
+            outPath = ["files", fpOf[file], "outs", outKey]
+            logCache(cacheFile, cache, outPath, str(outFile))
+
+            metaData = getMetaData(config.ffprobePath, outFile)
+            if isinstance(metaData, Exception):
+                yield Failed(metaData)
+                return
+
+            getMetaP = partial(getMeta, metaData, meta)
+
+            outParams = {k: getMetaP(k) for k in inParams}
+
+            for k in inParams:
+                msg = durDiffMsg(
+                    inParams[k]["duration"],
+                    outParams[k]["duration"],
+                    inParams[k]["codec_type"],
+                )
+                if msg:
+                    yield Message(msg)
+
+            filesLeft = [f for f in fileList[idx:] if f in works]
+
+            yield Result(
+                idx,
+                total,
+                file,
+                outFile,
+                file.stat().st_size,
+                outFile.stat().st_size,
+                float(inParams["audio"]["duration"]),
+                timeTaken,
+                sum(map(estimateSecs, filesLeft)),
+                len(filesLeft),
+                inParams,
+                outParams,
+            )
+
+            if verifier:
+                verifyOut(file, outFile)
+    finally:
+        if verifier:
+            for future in pending:
+                future.cancel()
+            verifier.shutdown(wait=False)
+        rmFiles([tmpFile])
+        if getJournal(historyFile).exists():
+            saveCache(historyFile, shared)
+        # scan results alone don't warrant a cache in an otherwise empty outDir
+        if getJournal(cacheFile).exists() or (changed and cacheFile.exists()):
+            saveCache(cacheFile, cache)
+        rmEmptyDirs([outDir])
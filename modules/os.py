@@ -1,16 +1,73 @@
+from os import name as osName
 from shutil import which as shWhich
-from subprocess import run
+from subprocess import DEVNULL, PIPE, CalledProcessError, Popen, run
+from threading import Thread
 
 
-def runCmd(cmd):
+class CmdAborted(Exception):
+    pass
+
+
+def runCmd(cmd, stdErr=False):
     try:
         cmdOut = run(cmd, check=True, capture_output=True, text=True)
-        cmdOut = cmdOut.stdout
+        cmdOut = cmdOut.stderr if stdErr else cmdOut.stdout
     except Exception as callErr:
         return callErr
     return cmdOut
 
 
+def runCmdWatch(cmd, watch):
+    # like runCmd but hands each ffmpeg -progress block to watch, a truthy
+    # return kills the process and comes back as CmdAborted(reason)
+    try:
+        with Popen(cmd, stdin=DEVNULL, stdout=PIPE, stderr=PIPE, text=True) as proc:
+            stdErr = []
+            errReader = Thread(target=lambda: stdErr.append(proc.stderr.read()))
+            errReader.start()
+            block = {}
+            for line in proc.stdout:
+                key, _, val = line.strip().partition("=")
+                block[key] = val
+                if key != "progress":
+                    continue
+                reason = watch(block)
+                if reason:
+                    proc.kill()
+                    errReader.join()
+                    return CmdAborted(reason)
+                block = {}
+            proc.wait()
+            errReader.join()
+    except Exception as callErr:
+        return callErr
+    if proc.returncode:
+        return CalledProcessError(proc.returncode, cmd, stderr="".join(stdErr))
+    return "".join(stdErr)
+
+
+def runCmdLow(cmd):
+    # runCmd below normal priority, returns stderr, for background work that
+    # shouldn't slow down a running encode
+    kw = {"stdin": DEVNULL, "stdout": PIPE, "stderr": PIPE, "text": True}
+    if osName == "nt":
+        from subprocess import BELOW_NORMAL_PRIORITY_CLASS
+
+        kw["creationflags"] = BELOW_NORMAL_PRIORITY_CLASS
+    try:
+        with Popen(cmd, **kw) as proc:
+            if osName != "nt":
+                from os import PRIO_PROCESS, setpriority
+
+                setpriority(PRIO_PROCESS, proc.pid, 10)
+            stdOut, stdErr = proc.communicate()
+    except Exception as callErr:
+        return callErr
+    if proc.returncode:
+        return CalledProcessError(proc.returncode, cmd, stdOut, stdErr)
+    return stdErr
+
+
 def checkPaths(paths):  # check abs paths too?
     retPaths = []
     for path, absPath in paths.items():
@@ -0,0 +1,207 @@
+from array import array
+from bisect import bisect
+from csv import writer
+from fractions import Fraction
+from os import cpu_count
+
+from .cache import loadCache, loadHistory, saveCache
+from .ffUtils.ffprobe import getDuration, getMeta
+from .helpers import bytesToMB, round2
+from .optimize import (
+    Message,
+    Report,
+    Started,
+    getHistoryFile,
+    getWork,
+    iterRoots,
+    meta,
+    prepOutDir,
+    scanFiles,
+    withPaths,
+)
+from .throughput import defaultSpeeds, fitLine, getKey, refWork
+
+# Rough output models, used when there is no history to go on
+
+videoKbps = {"avc": 1100.0, "hevc": 650.0, "av1": 500.0}  # at 720p30, default crf
+
+audioKbps = {"opus": 48.0, "he": 56.0, "aac": 72.0}
+
+copySpeed = 200.0  # x realtime for stream copy/audio only jobs
+
+encodeThreads = cpu_count() or 1  # encoders keep every core busy
+
+bands = [500, 1000, 2500, 5000, 10000, 20000]  # kbps
+
+columns = [
+    "codec",
+    "height",
+    "kbps_band",
+    "files",
+    "hours",
+    "size_mb",
+    "projected_mb",
+    "saved_mb",
+    "saved_pct",
+    "encode_hours",  # wall-clock on this machine
+    "cpu_hours",
+]
+
+
+def bandLabel(kbps):
+    i = bisect(bands, kbps)
+    lo = bands[i - 1] if i else 0
+    return f"{lo}+" if i == len(bands) else f"{lo}-{bands[i]}"
+
+
+def toFloat(val, default=0.0):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return default
+
+
+def getSummary(entry):
+    # the few fields a report needs, kept in the cache so that later reports
+    # skip filterMeta altogether
+    if "summary" not in entry:
+        metaData = entry["meta"]
+        vdo, ado = getMeta(metaData, meta, "video"), getMeta(metaData, meta, "audio")
+        try:
+            fps = float(Fraction(vdo["r_frame_rate"]))
+        except (KeyError, ValueError, ZeroDivisionError):
+            fps = 0.0
+        entry["summary"] = [
+            getDuration(metaData),
+            vdo.get("codec_name", "N/A"),
+            int(toFloat(vdo.get("height"))),
+            fps,
+            toFloat(vdo.get("bit_rate"), None),
+            ado.get("codec_name", "N/A"),
+            toFloat(ado.get("bit_rate"), None),
+        ]
+    return entry["summary"]
+
+
+def projectKbps(config, vdoKbps, adoKbps, fileKbps, work, duration):
+    # bit_rate from getMeta is already in kbps
+    adoKbps = 128.0 if adoKbps is None else adoKbps
+    vdoKbps = max(fileKbps - adoKbps, 0.0) if vdoKbps is None else vdoKbps
+
+    if config.cAudio != "ac":
+        adoKbps = min(adoKbps, float(config.qAudio or audioKbps[config.cAudio]))
+
+    if config.noVideo:
+        return adoKbps
+    if config.cVideo != "vc" and duration:
+        model = videoKbps[config.cVideo] * work / (refWork * duration)
+        vdoKbps = min(vdoKbps, model)
+    return vdoKbps + adoKbps
+
+
+def getEstimator(config, history):
+    # fitted once, then applied per file
+    speedKey = getKey(f"{config.cVideo}/{config.cAudio}", config.speed)
+    if history.get(speedKey):
+        a, b = fitLine(history[speedKey])
+        return lambda work: a + b * work
+    if config.cVideo in defaultSpeeds and not config.noVideo:
+        return lambda work: work / (refWork * defaultSpeeds[config.cVideo])
+    return lambda work: work / copySpeed
+
+
+def aggregate(config, cache, fpOf, sizes):
+    history = loadHistory(getHistoryFile(config), cache)["history"]
+    estimateSecs = getEstimator(config, history)
+    groups = {}
+    summed = ["files", "hours", "size_mb", "projected_mb", "encode_hours"]
+    cols = {c: array("d") for c in summed}
+
+    for file, fp in fpOf.items():
+        summary = getSummary(cache["files"][fp])
+        duration, vdoCodec, height, fps, vdoKbps, adoCodec, adoKbps = summary
+        size = sizes[file]
+        fileKbps = size * 8 / duration / 1000 if duration else 0.0
+        work = getWork(config, height or None, fps or None, duration)
+
+        if config.noVideo:
+            key = (adoCodec, 0, bandLabel(fileKbps))
+        else:
+            key = (vdoCodec, height, bandLabel(fileKbps))
+        if key not in groups:
+            groups[key] = len(groups)
+            for col in cols.values():
+                col.append(0.0)
+        i = groups[key]
+
+        outKbps = projectKbps(config, vdoKbps, adoKbps, fileKbps, work, duration)
+        outSize = min(outKbps * 1000 / 8 * duration, size)
+        cols["files"][i] += 1
+        cols["hours"][i] += duration / 3600
+        cols["size_mb"][i] += size
+        cols["projected_mb"][i] += outSize
+        cols["encode_hours"][i] += estimateSecs(work) / 3600
+
+    rows = []
+    for key, i in sorted(groups.items(), key=lambda g: -cols["size_mb"][g[1]]):
+        size, outSize = cols["size_mb"][i], cols["projected_mb"][i]
+        rows.append(
+            [
+                *key,
+                int(cols["files"][i]),
+                round2(cols["hours"][i]),
+                bytesToMB(size),
+                bytesToMB(outSize),
+                bytesToMB(size - outSize),
+                round2((size - outSize) / size * 100) if size else 0.0,
+                round2(cols["encode_hours"][i]),
+                round2(cols["encode_hours"][i] * encodeThreads),
+            ]
+        )
+    return rows
+
+
+def writeReport(reportFile, rows):
+    with open(reportFile, "w", newline="") as f:
+        csvWriter = writer(f)
+        csvWriter.writerow(columns)
+        csvWriter.writerows(rows)
+
+
+def totalsMsg(rows):
+    if not rows:
+        return "\nNothing to report."
+    sums = map(sum, list(zip(*rows))[3:])
+    files, hours, size, outSize, _, _, encHours, cpuHours = sums
+    saved = size - outSize
+    return (
+        f"\nFiles: {files}, duration: {round2(hours)} hours, size: {round2(size)} MB."
+        f"\nProjected output size: {round2(outSize)} MB, saving: {round2(saved)} MB"
+        f" ({round2(saved / size * 100) if size else 0.0}%)"
+        f" for about {round2(encHours)} encode hours ({round2(cpuHours)} CPU-hours)."
+    )
+
+
+def report(paths, config=None):
+    """
+    Forecast output size and encode time for each of paths with the given
+    config, without encoding anything. Yields Started/Failed/Report events.
+    """
+    config = withPaths(config)
+    for dirPath, fileList in iterRoots(paths, config):
+        outDir, fileList = prepOutDir(config, dirPath, fileList)
+        cacheFile = outDir.joinpath(f"{dirPath.stem}.cache.json")
+        cache = loadCache(cacheFile)
+
+        yield Started(dirPath, outDir, len(fileList))
+
+        fpOf, _ = yield from scanFiles(config, cache, fileList)
+
+        sizes = {f: cache["paths"][str(f)][0] for f in fpOf}
+        rows = aggregate(config, cache, fpOf, sizes)
+        saveCache(cacheFile, cache)  # after aggregate, which fills in the summaries
+        reportFile = outDir.joinpath(f"{dirPath.stem}.report.csv")
+        writeReport(reportFile, rows)
+
+        yield Message(totalsMsg(rows))
+        yield Report(reportFile, rows)
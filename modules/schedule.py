@@ -0,0 +1,52 @@
+from .throughput import defaultSpeeds, fitLine, getKey, refWork
+
+# slowest to fastest
+presetLadders = {
+    "avc": ["slower", "slow", "medium", "fast", "faster"],
+    "hevc": ["slow", "medium", "fast", "faster"],
+    "av1": ["4", "6", "8", "10"],
+}
+
+defaultPresets = {"avc": "slow", "hevc": "medium", "av1": "8"}  # see selectCodec
+
+stepCost = 1.6  # rough extra time per step down the ladder, until measured
+
+
+def getPredictor(history, codecKey, codec):
+    """
+    Returns predict(level, work) -> secs for the codec's preset ladder. Presets
+    with history use their own fitted line, others are scaled from the
+    nearest measured preset by stepCost.
+    """
+    ladder = presetLadders[codec]
+    lines = {}
+    for level, preset in enumerate(ladder):
+        samples = history.get(getKey(codecKey, preset), [])
+        if preset == defaultPresets[codec]:
+            samples = [*samples, *history.get(getKey(codecKey, None), [])]
+        if samples:
+            lines[level] = fitLine(samples)
+    if not lines:
+        base = ladder.index(defaultPresets[codec])
+        lines[base] = (0.0, 1 / (refWork * defaultSpeeds[codec]))
+
+    def predict(level, work):
+        near = min(lines, key=lambda k: abs(k - level))
+        a, b = lines[near]
+        return (a + b * work) * stepCost ** (near - level)
+
+    return predict
+
+
+def planPresets(files, works, predict, ladder, budget):
+    # start everything on the fastest preset, then move files to slower ones,
+    # a level at a time, for as long as the whole queue still fits the budget
+    levels = {f: len(ladder) - 1 for f in files}
+    spent = sum(predict(levels[f], works[f]) for f in files)
+    for level in reversed(range(len(ladder) - 1)):
+        for f in files:
+            extra = predict(level, works[f]) - predict(levels[f], works[f])
+            if spent + extra <= budget:
+                levels[f] = level
+                spent += extra
+    return {f: ladder[levels[f]] for f in files}, spent
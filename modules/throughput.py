@@ -0,0 +1,62 @@
+from fractions import Fraction
+from statistics import fmean
+
+maxSamples = 250  # per key, oldest are dropped first
+
+getKey = lambda codec, preset: f"{codec}:{defPreset(preset)}"
+
+defPreset = lambda preset: preset if preset else "default"
+
+
+def workUnits(duration, height=None, fps=None):
+    # media seconds, scaled by output megapixels per second for video
+    try:
+        height, fps = int(height), float(Fraction(fps))
+    except (TypeError, ValueError, ZeroDivisionError):
+        return float(duration)
+    return float(duration) * (height * height * 16 / 9) * fps / 1e6
+
+
+refWork = workUnits(1, 720, 30)
+
+# x realtime at 720p30 with the default preset, used when there is no history
+defaultSpeeds = {"avc": 3.0, "hevc": 1.2, "av1": 2.0}
+
+
+def addSample(history, key, work, secs):
+    samples = history.setdefault(key, [])
+    samples.append([work, secs])
+    del samples[:-maxSamples]
+
+
+def fitLine(samples):
+    # least squares secs = a + b * work, falls back to a line through origin
+    xs, ys = [s[0] for s in samples], [s[1] for s in samples]
+    mx, my = fmean(xs), fmean(ys)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if len(samples) > 2 and sxx:
+        b = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+        a = my - b * mx
+        if b > 0 and a >= 0:
+            return a, b
+    return 0.0, (sum(ys) / sum(xs) if sum(xs) else 0.0)
+
+
+def predictSecs(history, key, work):
+    samples = history.get(key)
+    if not samples:
+        return None
+    a, b = fitLine(samples)
+    return a + b * work
+
+
+orderPolicies = {
+    "longest": True,  # pack long jobs first
+    "shortest": False,  # most files done per hour
+}
+
+
+def orderFiles(files, estimate, policy):
+    if policy not in orderPolicies:
+        return files
+    return sorted(files, key=estimate, reverse=orderPolicies[policy])
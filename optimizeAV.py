@@ -1,33 +1,15 @@
 import argparse
-import atexit
 from functools import partial
-from pathlib import Path
-from shlex import join as shJoin
-from statistics import fmean
-from sys import version_info
-from time import time
 
-from modules.ffUtils.ffmpeg import getffmpegCmd, optsVideo, selectCodec
-from modules.ffUtils.ffprobe import compareDur, formatParams, getMeta, getMetaData
-from modules.fs import cleanUp, getFileList, getFileListRec, makeTargetDirs
-from modules.helpers import (
-    bytesToMB,
-    dynWait,
-    fileDTime,
-    nothingExit,
-    round2,
-    secsToHMS,
-)
-from modules.io import printNLog, reportErr, startMsg, statusInfo, waitN
-from modules.os import checkPaths, runCmd
-from modules.pkgState import setLogFile
-from modules.cli import checkDirPath, checkValIn
+from modules.cli import checkDeadline, checkDirPath, checkValIn
 
 
 def parseArgs():
 
     aCodec = partial(checkValIn, ["opus", "he", "aac", "ac"], str)
     vCodec = partial(checkValIn, ["avc", "hevc", "av1", "vn", "vc"], str)
+    order = partial(checkValIn, ["longest", "shortest"], str)
+    fallback = partial(checkValIn, ["copy", "skip"], str)
 
     parser = argparse.ArgumentParser(
         description="Optimize Video/Audio files by encoding to avc/hevc/aac/opus."
@@ -104,196 +86,211 @@ def parseArgs():
         type=int,
         help="Audio Quality/bitrate in kbps; (defaults:: opus: 48, he: 56 and aac: 72)",
     )
+    parser.add_argument(
+        "-dd",
+        "--dedup",
+        action="store_true",
+        help="Link the existing output of an identical input (same content "
+        "fingerprint) instead of encoding it again.",
+    )
+    parser.add_argument(
+        "-fh",
+        "--fullHash",
+        action="store_true",
+        help="Hash whole files for fingerprints instead of sampled head, middle "
+        "and tail blocks.",
+    )
+    parser.add_argument(
+        "-o",
+        "--order",
+        default=None,
+        type=order,
+        help='Order files by predicted encode time; "longest" first or "shortest" '
+        "first. (default: directory order)",
+    )
+    parser.add_argument(
+        "-ln",
+        "--loudnorm",
+        action="store_true",
+        help="Normalize audio loudness (EBU R128, speech targets); loudness is "
+        "measured once per file and cached.",
+    )
+    parser.add_argument(
+        "-fp",
+        "--fastProbe",
+        action="store_true",
+        help="Read MP4/MOV, MKV, WAV and FLAC headers directly when scanning "
+        "inputs, ffprobe is only used for anything that can't be parsed.",
+    )
+    parser.add_argument(
+        "-rp",
+        "--report",
+        action="store_true",
+        help="Only forecast output size and encode time per codec, resolution and "
+        "bitrate band; writes a csv report, nothing is encoded.",
+    )
+    parser.add_argument(
+        "-ga",
+        "--growAbort",
+        nargs="?",
+        default=None,
+        const=1.0,
+        type=float,
+        help="Abort encodes whose output is projected to exceed this fraction of "
+        "the input size, default is 1.0",
+    )
+    parser.add_argument(
+        "-gf",
+        "--growFallback",
+        default="copy",
+        type=fallback,
+        help='What to do after an aborted encode; stream "copy" the input or '
+        '"skip" the file. (default: copy)',
+    )
+    parser.add_argument(
+        "-cr",
+        "--autoCrop",
+        action="store_true",
+        help="Detect black bars on a few short sections of each video and crop "
+        "them before scaling.",
+    )
+    parser.add_argument(
+        "-dl",
+        "--deadline",
+        default=None,
+        type=checkDeadline,
+        help="Finish the queue by this time of day (HH:MM); picks the slowest "
+        "avc/hevc/av1 preset per file that still fits, overrides --speed.",
+    )
+    parser.add_argument(
+        "-vr",
+        "--verify",
+        action="store_true",
+        help="Fully decode each output in the background while the next file "
+        "encodes; outputs with decode errors are removed and requeued once.",
+    )
+    parser.add_argument(
+        "-hf",
+        "--historyFile",
+        default=None,
+        help="Where encode speed samples are kept, shared by every library. "
+        "(default: ~/.optimizeAV/history.json)",
+    )
     return parser.parse_args()
 
 
-pargs = parseArgs()
-
-ffprobePath, ffmpegPath = checkPaths(
-    {
-        "ffprobe": r"C:\ffmpeg\bin\ffprobe.exe",
-        "ffmpeg": r"C:\ffmpeg\bin\ffmpeg.exe",
-    }
-)
-
-noVideo = True if pargs.cVideo == "vn" else False
-
-if noVideo:
-
-    formats = [".flac", ".wav", ".m4a", ".mp3", ".mp4"]
-
-    outExt = ".opus" if pargs.cAudio == "opus" else ".m4a"
-else:
-
-    formats = [".mp4", ".mov", ".mkv", ".avi"]
-
-    outExt = ".mp4"
-
-meta = {
-    "basic": ["codec_type", "codec_name", "profile", "duration", "bit_rate"],
-    "audio": ["channels", "sample_rate"],
-    "video": ["height", "r_frame_rate"],
-}
-
-dirPath = pargs.dir.resolve()
-
-if pargs.recursive:
-    getFilePaths = getFileListRec
-else:
-    getFilePaths = getFileList
-
-fileList = getFilePaths(dirPath, formats)
-
-if not fileList:
-    nothingExit()
-
-outDir = makeTargetDirs(dirPath, [f"out-{outExt[1:]}"])[0]
-tmpFile = outDir.joinpath(f"tmp-{fileDTime()}{outExt}")
-setLogFile(outDir.joinpath(f"{dirPath.stem}.log"))
-
-if pargs.recursive:
-    if version_info >= (3, 9):
-        fileList = [f for f in fileList if not f.is_relative_to(outDir)]
-    else:
-        fileList = [f for f in fileList if not (str(outDir) in str(f))]
-
-outFileList = getFilePaths(outDir, [outExt])
-
-atexit.register(cleanUp, [outDir], [tmpFile])
-
-startMsg()
-
-getMetaDataP = partial(getMetaData, ffprobePath)
-
-totalTime, inSizes, outSizes, lengths = ([] for i in range(4))
-
-for idx, file in enumerate(fileList):
-
-    outFile = Path(outDir.joinpath(file.relative_to(dirPath).with_suffix(outExt)))
-
-    statusInfoP = partial(statusInfo, idx=f"{idx+1}/{len(fileList)}", file=file)
-
-    if any(outFileList) and outFile in outFileList:
-        statusInfoP("Skipping")
-        continue
-
-    statusInfoP("Processing")
-
-    metaData = getMetaDataP(file)
-    if isinstance(metaData, Exception):
-        reportErr(metaData)
-        break
-
-    getMetaP = partial(getMeta, metaData, meta)
-
-    adoInParams = getMetaP("audio")
+def printResult(res, stats):
+    from statistics import fmean
 
-    ov = []
+    from modules.ffUtils.ffprobe import formatParams
+    from modules.helpers import bytesToMB, round2, secsToHMS
+    from modules.io import printNLog
 
-    if not noVideo:
-        vdoInParams = getMetaP("video")
-
-        if not pargs.cVideo == "vc":
-            ov = optsVideo(
-                vdoInParams["height"], vdoInParams["r_frame_rate"], pargs.res, pargs.fps
-            )
-
-    ca = selectCodec(pargs.cAudio, pargs.qAudio)
-    cv = selectCodec(pargs.cVideo, pargs.qVideo, pargs.speed)
-    cmd = getffmpegCmd(ffmpegPath, file, tmpFile, ca, cv, ov)
-
-    printNLog(f"\n{shJoin(cmd)}")
-    strtTime = time()
-    cmdOut = runCmd(cmd)
-    if isinstance(cmdOut, Exception):
-        reportErr(cmdOut)
-        break
-    timeTaken = time() - strtTime
-    totalTime.append(timeTaken)
-
-    printNLog(cmdOut)
-    if pargs.recursive and not outFile.parent.exists():
-        outFile.parent.mkdir(parents=True)
-
-    tmpFile.rename(outFile)
-
-    statusInfoP("Processed")
-
-    metaData = getMetaDataP(outFile)
-    if isinstance(metaData, Exception):
-        reportErr(metaData)
-        break
-
-    getMetaP = partial(getMeta, metaData, meta)
-
-    if not noVideo:
-
-        vdoOutParams = getMetaP("video")
+    totalTime, inSizes, outSizes, lengths = stats
+    totalTime.append(res.timeTaken)
+    inSizes.append(res.inSize)
+    outSizes.append(res.outSize)
+    lengths.append(res.length)
+    inSum, inMean, = sum(inSizes), fmean(inSizes)  # fmt: skip
+    outSum, outMean = sum(outSizes), fmean(outSizes)
+    # clones/links can finish within one clock tick
+    speed = lambda length, secs: round2(length / secs) if secs else "N/A"
 
+    for strm, params in res.inParams.items():
         printNLog(
-            f"\nVideo Input:: {formatParams(vdoInParams)}"
-            f"\nVideo Output:: {formatParams(vdoOutParams)}"
+            f"\n{strm.title()} Input:: {formatParams(params)}"
+            f"\n{strm.title()} Output:: {formatParams(res.outParams[strm])}"
         )
 
-        compareDur(
-            vdoInParams["duration"],
-            vdoOutParams["duration"],
-            vdoInParams["codec_type"],
-        )
-
-    adoOutParams = getMetaP("audio")
-
-    printNLog(
-        f"\nAudio Input:: {formatParams(adoInParams)}"
-        f"\nAudio Output:: {formatParams(adoOutParams)}"
-    )
-
-    compareDur(
-        adoInParams["duration"],
-        adoOutParams["duration"],
-        adoInParams["codec_type"],
-    )
-
-    inSize = file.stat().st_size
-    outSize = outFile.stat().st_size
-    length = float(adoInParams["duration"])
-    inSizes.append(inSize)
-    outSizes.append(outSize)
-    lengths.append(length)
-    inSum, inMean, = sum(inSizes), fmean(inSizes)  # fmt: skip
-    outSum, outMean = sum(outSizes), fmean(outSizes)
-    filesLeft = len(fileList) - (idx + 1)
-
     printNLog(
         "\n"
-        f"\nProcessed: {secsToHMS(length)}/{bytesToMB(inSize)} MB"
-        f" in: {secsToHMS(timeTaken)}/{bytesToMB(outSize)} MB"
-        f" at speed: x{round2(length/timeTaken)}."
+        f"\nProcessed: {secsToHMS(res.length)}/{bytesToMB(res.inSize)} MB"
+        f" in: {secsToHMS(res.timeTaken)}/{bytesToMB(res.outSize)} MB"
+        f" at speed: x{speed(res.length, res.timeTaken)}."
         "\n"
         f"\nTotal size reduced by: {(bytesToMB(inSum-outSum))} MB "
         f"to {(bytesToMB(outSum))} MB at an average of:"
         f" {round2(((inMean-outMean)/inMean)*100)}% size reduction."
         f"\nProcessed: {secsToHMS(sum(totalTime))}/{(bytesToMB(inSum))} MB"
-        f" at average speed: x{round2(fmean(lengths)/fmean(totalTime))}"
+        f" at average speed: x{speed(fmean(lengths), fmean(totalTime))}"
         f" for average input size: {(bytesToMB(inMean))} MB."
-        f"\nEstimated output size: {bytesToMB(outMean * len(fileList))} MB"
-        f" for: {len(fileList)} file(s) at average output"
+        f"\nEstimated output size: {bytesToMB(outMean * res.total)} MB"
+        f" for: {res.total} file(s) at average output"
         f" size: {(bytesToMB(outMean))} MB."
         "\nEstimated time left: "
-        f"{secsToHMS(fmean(totalTime) * filesLeft)} for: {filesLeft} file(s)"
+        f"{secsToHMS(res.timeLeft)} for: {res.filesLeft} file(s)"
         f" at average processing time: {secsToHMS(fmean(totalTime))}."
     )
 
-    if idx + 1 == len(fileList):
-        continue
 
-    if pargs.wait:
-        waitN(int(pargs.wait))
+def main():
+    pargs = parseArgs()
+
+    # deferred so that --help and argument errors don't pay for them
+    from shlex import join as shJoin
+
+    from modules.helpers import dynWait, nothingExit
+    from modules.io import printNLog, reportErr, startMsg, statusInfo, waitN
+    from modules.optimize import (
+        Command,
+        Failed,
+        Message,
+        Report,
+        Result,
+        Started,
+        Status,
+        configFromArgs,
+        optimize,
+    )
+    from modules.pkgState import setLogFile
+
+    if pargs.report:
+        from modules.report import report as run
     else:
-        waitN(int(dynWait(timeTaken)))
+        run = optimize
+
+    started = False
+
+    for event in run(pargs.dir, configFromArgs(pargs)):
+
+        if isinstance(event, Started):
+            started = True
+            stats = tuple([] for i in range(4))
+            setLogFile(event.outDir.joinpath(f"{event.root.stem}.log"))
+            startMsg()
+
+        elif isinstance(event, Status):
+            statusInfo(event.status, f"{event.idx}/{event.total}", event.file)
+
+        elif isinstance(event, Command):
+            printNLog(f"\n{shJoin(event.cmd)}")
+
+        elif isinstance(event, Message):
+            printNLog(event.text)
+
+        elif isinstance(event, Failed):
+            reportErr(event.error)
+
+        elif isinstance(event, Report):
+            printNLog(f"\nReport saved to: {str(event.reportFile)}")
+
+        elif isinstance(event, Result):
+            printResult(event, stats)
+
+            if event.idx == event.total:
+                continue
+
+            if pargs.wait:
+                waitN(int(pargs.wait))
+            else:
+                waitN(int(dynWait(event.timeTaken)))
+
+    if not started:
+        nothingExit()
+
 
-def exe():
-    pass
+if __name__ == "__main__":
+    main()
 
 # H264(x264): medium efficiency, fast encoding, widespread support
 # > H265(x265): high efficiency, slow encoding, medicore support